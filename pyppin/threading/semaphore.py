@@ -37,9 +37,12 @@ manager API's::
 The first syntax grabs one unit of resource, blocking indefinitely, and raises an exception
 (BrokenPipeError) if the semaphore somehow got shut down before you could get any. The
 second one is a more flexible syntax that lets you control all of these behaviors; with this
-syntax, you need to check whether the resource was successfully acquired.
+syntax, you need to check whether the resource was successfully acquired. And if all you want to do
+is call a function while holding some capacity, ``semaphore.run(function)`` does exactly that,
+raising just like the first syntax on failure. (Use ``functools.partial`` to pass it arguments.)
 
-This class is thread-safe.
+This class is thread-safe. Blocked acquirers are served in first-come, first-served order, so a
+request for a large amount of capacity won't be starved by a stream of small ones.
 
 Useful Ways to Use It
 =====================
@@ -86,15 +89,27 @@ highly-visible public event. Don't let this happen to you. Release before you ac
 """
 
 
-from contextlib import AbstractContextManager
+from collections import deque
 from enum import Enum
-from threading import Condition, Lock
+from threading import Condition, Event, Lock
 from time import monotonic
 from types import TracebackType
-from typing import NamedTuple, Optional, Type
+from typing import Callable, Deque, NamedTuple, Optional, Type, TypeVar
+
+T = TypeVar("T")
 
 
 class Semaphore(object):
+    __slots__ = (
+        "_lock",
+        "_drained",
+        "_capacity",
+        "_current",
+        "_stopped",
+        "_waiters",
+        "__weakref__",
+    )
+
     def __init__(self, capacity: Optional[int] = None) -> None:
         """Create a semaphore.
 
@@ -103,10 +118,16 @@ class Semaphore(object):
               infinite value.
         """
         self._lock = Lock()
-        self._cond = Condition(self._lock)
+        # Set once we're stopped and all capacity has been released. Only stop() ever waits on
+        # this, so it's created on demand; most semaphores never need it.
+        self._drained: Optional[Event] = None
         self._capacity = capacity
         self._current: int = 0
         self._stopped = False
+        # Acquirers that are blocked waiting for capacity, in arrival order. release() hands
+        # capacity directly to the waiters at the head of this queue, so that we only wake up
+        # threads whose requests can actually be satisfied.
+        self._waiters: Deque[_Waiter] = deque()
 
     class AcquireResult(Enum):
         """The result of an acquire() operation on a semaphore."""
@@ -149,27 +170,50 @@ class Semaphore(object):
         """
         assert amount >= 0
 
-        # We may have to wait many times, so store the total deadline time. NB that all Python
-        # threading code uses time.monotonic as its underlying clock, for hopefully obvious reasons.
-        deadline = monotonic() + timeout if timeout is not None else None
-
         with self._lock:
-            while True:
-                if self._stopped:
-                    return self.AcquireResult.STOPPED
-
-                if self._capacity is None or self._current + amount <= self._capacity:
-                    self._current += amount
-                    return self.AcquireResult.SUCCESS
-
-                if deadline is not None:
-                    now = monotonic()
-                    if now >= deadline:
-                        return self.AcquireResult.TIMEOUT
-
-                    self._cond.wait(timeout=deadline - now)
-                else:
-                    self._cond.wait()
+            if self._stopped:
+                return _STOPPED
+
+            # Don't jump the queue: if anyone is already waiting, we wait behind them.
+            if self._fits(amount) and (
+                not self._waiters or not self._has_eligible_waiters()
+            ):
+                self._current += amount
+                return _SUCCESS
+
+            # Only now that we know we'd have to block do we bother looking at the clock.
+            if timeout is not None and timeout <= 0:
+                return _TIMEOUT
+
+            # We may have to wait many times, so store the total deadline time. NB that all Python
+            # threading code uses time.monotonic as its underlying clock, for hopefully obvious
+            # reasons.
+            deadline = monotonic() + timeout if timeout is not None else None
+
+            waiter = _Waiter(amount, self._lock)
+            self._waiters.append(waiter)
+            try:
+                while not waiter.granted:
+                    if self._stopped:
+                        return _STOPPED
+
+                    if deadline is not None:
+                        now = monotonic()
+                        if now >= deadline:
+                            return _TIMEOUT
+
+                        waiter.cond.wait(timeout=deadline - now)
+                    else:
+                        waiter.cond.wait()
+
+                return _SUCCESS
+
+            finally:
+                # If we gave up, get out of the queue; stop() empties the queue itself. Leaving
+                # may unblock whoever was behind us.
+                if not waiter.granted and not self._stopped:
+                    self._waiters.remove(waiter)
+                    self._grant_to_waiters()
 
     def acquire_checked(self, amount: int = 1, timeout: Optional[float] = None) -> None:
         """Acquire, raising an exception on failure.
@@ -187,9 +231,9 @@ class Semaphore(object):
                 could complete. This is a non-retriable error.
         """
         result = self.acquire(amount=amount, timeout=timeout)
-        if result == self.AcquireResult.TIMEOUT:
+        if result is _TIMEOUT:
             raise TimeoutError()
-        elif result == self.AcquireResult.STOPPED:
+        elif result is _STOPPED:
             raise BrokenPipeError()
 
     def try_acquire(self, amount: int = 1) -> bool:
@@ -201,7 +245,7 @@ class Semaphore(object):
         Returns:
             True if the capacity was acquired, false otherwise.
         """
-        return self.acquire(amount=amount, timeout=0) == self.AcquireResult.SUCCESS
+        return self.acquire(amount=amount, timeout=0) is _SUCCESS
 
     def release(self, amount: int = 1) -> None:
         """Release capacity acquired via ``acquire()``."""
@@ -212,13 +256,10 @@ class Semaphore(object):
         with self._lock:
             assert self._current >= amount
             self._current -= amount
-            if amount == 1:
-                self._cond.notify()
-            else:
-                # If we released multiple units, it's possible that multiple waiters need to awaken.
-                # This is a less common case, and notifying everyone is very expensive, so we only
-                # do this if we have to!
-                self._cond.notify_all()
+            if self._waiters:
+                self._grant_to_waiters()
+            elif self._stopped and not self._current and self._drained is not None:
+                self._drained.set()
 
     def stop(self, timeout: Optional[float] = None) -> bool:
         """Shut down the semaphore.
@@ -236,8 +277,16 @@ class Semaphore(object):
 
         with self._lock:
             self._stopped = True
-            self._cond.notify_all()
-            return self._cond.wait_for(lambda: self._current == 0, timeout=timeout)
+            for waiter in self._waiters:
+                waiter.cond.notify()
+            self._waiters.clear()
+            if self._drained is None:
+                self._drained = Event()
+                if not self._current:
+                    self._drained.set()
+            drained = self._drained
+
+        return drained.wait(timeout=timeout)
 
     def set_capacity(self, capacity: Optional[int]) -> None:
         """Modify the capacity of the semaphore.
@@ -247,15 +296,44 @@ class Semaphore(object):
         """
         with self._lock:
             assert not self._stopped
-            big_delta = self._capacity is not None and (
-                capacity is None or (capacity - self._capacity) > 1
-            )
             self._capacity = capacity
-            # Same reasoning as inside release().
-            if big_delta:
-                self._cond.notify_all()
-            else:
-                self._cond.notify()
+            self._grant_to_waiters()
+
+    def _fits(self, amount: int) -> bool:
+        """Whether amount more units of capacity are available. Call with the lock held."""
+        return self._capacity is None or self._current + amount <= self._capacity
+
+    def _can_ever_fit(self, waiter: "_Waiter") -> bool:
+        """Whether waiter's request fits within the current capacity at all. A waiter that
+        doesn't can only be served if set_capacity() raises the capacity.
+        """
+        return self._capacity is None or waiter.amount <= self._capacity
+
+    def _has_eligible_waiters(self) -> bool:
+        """Whether anyone in the queue could be served, and so must be served before a newcomer.
+        Call with the lock held.
+        """
+        return any(self._can_ever_fit(waiter) for waiter in self._waiters)
+
+    def _grant_to_waiters(self) -> None:
+        """Hand capacity to the waiters at the head of the queue, in order, for as long as their
+        requests fit. Waiters whose requests are larger than the entire capacity stay queued (in
+        case the capacity grows again), but don't hold up anyone behind them. Call with the lock
+        held.
+        """
+        waiters = self._waiters
+        index = 0
+        while index < len(waiters):
+            waiter = waiters[index]
+            if not self._can_ever_fit(waiter):
+                index += 1
+                continue
+            if not self._fits(waiter.amount):
+                break
+            del waiters[index]
+            self._current += waiter.amount
+            waiter.granted = True
+            waiter.cond.notify()
 
     class Status(NamedTuple):
         capacity: Optional[int]
@@ -268,7 +346,11 @@ class Semaphore(object):
         with self._lock:
             return self.Status(self._capacity, self._current, self._stopped)
 
-    class Resource(AbstractContextManager):
+    class Resource(object):
+        # NB: This doesn't inherit from AbstractContextManager, which would give it a __dict__;
+        # it's still recognized as one, since that class checks for __enter__ and __exit__.
+        __slots__ = ("sem", "amount", "status")
+
         def __init__(
             self,
             sem: "Semaphore",
@@ -287,7 +369,7 @@ class Semaphore(object):
             self.amount = amount
             if check:
                 self.sem.acquire_checked(self.amount, timeout=timeout)
-                self.status = Semaphore.AcquireResult.SUCCESS
+                self.status = _SUCCESS
             else:
                 self.status = self.sem.acquire(self.amount, timeout=timeout)
 
@@ -300,11 +382,11 @@ class Semaphore(object):
             exc_value: Optional[BaseException],
             traceback: Optional[TracebackType],
         ) -> None:
-            if self.status == Semaphore.AcquireResult.SUCCESS:
+            if self.status is _SUCCESS:
                 self.sem.release(self.amount)
 
         def __bool__(self) -> bool:
-            return self.status == Semaphore.AcquireResult.SUCCESS
+            return self.status is _SUCCESS
 
     def get(
         self, amount: int = 1, timeout: Optional[float] = None, check: bool = False
@@ -345,7 +427,7 @@ class Semaphore(object):
         Raises:
             BrokenPipeError: If the sempahore is stopped before the acquisition could complete.
         """
-        self.acquire_checked()
+        self._acquire_one()
 
     def __exit__(
         self,
@@ -356,3 +438,80 @@ class Semaphore(object):
         # Note that we can only get here if we called Semaphore.__enter__, rather than
         # Resource.__enter__, so we know that the amount acquired was 1.
         self.release()
+
+    def run(
+        self,
+        function: Callable[[], T],
+        amount: int = 1,
+        timeout: Optional[float] = None,
+    ) -> T:
+        """Call a function while holding capacity from the semaphore.
+
+        ``semaphore.run(function, amount, timeout)`` is equivalent to::
+
+            with semaphore.get(amount=amount, timeout=timeout, check=True):
+                return function()
+
+        but without creating a context manager along the way, which makes it a cheaper way to
+        throttle calls in a hot loop.
+
+        The function takes no arguments, so that its own arguments can never be confused with
+        the ones here; to pass some, use ``functools.partial``, e.g.
+        ``semaphore.run(partial(fetch, url, timeout=5))``.
+
+        Args:
+            function: The function to call.
+            amount: The amount of capacity to hold while calling it.
+            timeout: How long we should block to acquire the capacity, in seconds, or None (the
+                default) to wait forever.
+
+        Returns:
+            Whatever the function returns.
+
+        Raises:
+            TimeoutError: If timeout != None and the request timed out.
+            BrokenPipeError: If the semaphore was stopped before the acquisition could complete.
+        """
+        if amount == 1 and timeout is None:
+            self._acquire_one()
+        else:
+            self.acquire_checked(amount, timeout=timeout)
+
+        try:
+            return function()
+        finally:
+            self.release(amount)
+
+    def _acquire_one(self) -> None:
+        """Acquire a single unit, blocking forever and raising on failure."""
+        # Fast path for the common uncontended case, specialized to a single unit; anything that
+        # might block or fail goes through the general logic.
+        with self._lock:
+            if (
+                not self._stopped
+                and not self._waiters
+                and (self._capacity is None or self._current < self._capacity)
+            ):
+                self._current += 1
+                return
+
+        self.acquire_checked()
+
+
+# AcquireResult members are singletons, so the hot paths compare against these by identity instead
+# of looking them up through two levels of class attributes on every call.
+_SUCCESS = Semaphore.AcquireResult.SUCCESS
+_TIMEOUT = Semaphore.AcquireResult.TIMEOUT
+_STOPPED = Semaphore.AcquireResult.STOPPED
+
+
+class _Waiter(object):
+    """A single acquirer blocked inside Semaphore.acquire()."""
+
+    __slots__ = ("amount", "granted", "cond")
+
+    def __init__(self, amount: int, lock: Lock) -> None:
+        self.amount = amount
+        # Set (under the lock) once the semaphore has reserved our capacity for us.
+        self.granted = False
+        self.cond = Condition(lock)
@@ -28,8 +28,8 @@ from typing import Optional, Type
 
 from pyppin.threading.stack_trace_internals import all_stacks, print_stacks
 
-# NB: This library is unittested in tests/testing/trace_on_failure_test.py, which also tests the
-# handy unittest wrappers for it.
+# NB: This library is unittested in tests/threading/stack_trace_test.py; its handy unittest
+# wrappers are tested in tests/testing/trace_on_failure_test.py.
 
 
 def print_all_stacks(
@@ -37,6 +37,8 @@ def print_all_stacks(
     limit: Optional[int] = None,
     daemons: bool = True,
     group: bool = True,
+    source: bool = True,
+    active_only: bool = False,
 ) -> None:
     """Print the stack traces of all active threads.
 
@@ -47,8 +49,19 @@ def print_all_stacks(
             <https://docs.python.org/3/library/traceback.html>`_ module)
         daemons: Whether to include daemon threads.
         group: If True, group together threads with identical traces.
+        source: If True, show the line of source code for each frame, just like the traceback
+            module does. If False, show only the file, line number, and function name; this is
+            more compact, and skips looking up source files.
+        active_only: If True, leave out threads that are just blocked waiting on a Condition,
+            Event, Semaphore, Barrier, or Queue, or in Thread.join(). (Threads blocked on a plain
+            Lock look just like running ones, so they're always shown.)
     """
-    print_stacks(all_stacks(limit=limit, daemons=daemons), output=output, group=group)
+    print_stacks(
+        all_stacks(limit=limit, daemons=daemons, active_only=active_only),
+        output=output,
+        group=group,
+        source=source,
+    )
 
 
 def print_all_stacks_on_failure() -> None:
@@ -11,14 +11,27 @@ anger. Do not mess with them unless you understand Python's GC system quite well
 """
 
 import io
+import linecache
 import sys
 import threading
 import traceback
 from abc import ABC, abstractmethod
-from collections import defaultdict
+from collections import deque
 from enum import Enum
+from itertools import islice
 from types import FrameType
-from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Union
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 #################################################################################################
 # More advanced API's, if you want to muck with the stack traces yourself
@@ -82,22 +95,34 @@ class ThreadStack(object):
     frame objects.
     """
 
+    __slots__ = (
+        "thread",
+        "stack",
+        "exception",
+        "_formatted",
+        "_cluster_key",
+        "_cluster_id",
+        "__weakref__",
+    )
+
     def __init__(
         self,
         thread: Optional[threading.Thread],
         stack: Optional[traceback.StackSummary],
-        exception: Optional[BaseException],
+        exception: Union[BaseException, traceback.TracebackException, None],
+        limit: Optional[int] = None,
     ) -> None:
         # These are public variables, and you can look at them!
         self.thread = thread
         self.stack = stack
         self.exception = (
-            traceback.TracebackException.from_exception(exception)
-            if exception
-            else None
+            _traceback_exception(exception, limit)
+            if isinstance(exception, BaseException)
+            else exception
         )
 
         self._formatted: Optional[List[TraceLine]] = None
+        self._cluster_key: Optional[Tuple[object, ...]] = None
         self._cluster_id: Optional[int] = None
 
     @property
@@ -144,16 +169,26 @@ class ThreadStack(object):
         losing data.
         """
         if self._cluster_id is None:
-            self._cluster_id = hash(
-                tuple(
-                    line.line
-                    for line in self.formatted
-                    if line.line_type
-                    in (TraceLineType.TRACE_LINE, TraceLineType.EXCEPTION)
-                )
-            )
+            self._cluster_id = hash(self.cluster_key)
         return self._cluster_id
 
+    @property
+    def cluster_key(self) -> Tuple[object, ...]:
+        """Everything that goes into this thread's formatted trace, other than its title.
+
+        Two threads have equal keys exactly when their traces are identical, which is what
+        grouping goes by; cluster_id is its hash. This is computed straight from the frames,
+        rather than from self.formatted, so that grouping threads never requires formatting them
+        (which means reading source files); only one representative of each group ever gets
+        formatted.
+        """
+        if self._cluster_key is None:
+            self._cluster_key = (
+                _frame_keys(self.stack),
+                _exception_key(self.exception) if self.exception is not None else None,
+            )
+        return self._cluster_key
+
     @property
     def name(self) -> str:
         """A name for this thread, suitable for use as a title in a trace."""
@@ -171,7 +206,9 @@ class ThreadStack(object):
             return f'Thread "{self.thread.name}" ({d}not started)'
 
 
-def all_stacks(limit: Optional[int] = None, daemons: bool = True) -> List[ThreadStack]:
+def all_stacks(
+    limit: Optional[int] = None, daemons: bool = True, active_only: bool = False
+) -> List[ThreadStack]:
     """Return the stack summaries for all active threads.
 
     Args:
@@ -179,21 +216,37 @@ def all_stacks(limit: Optional[int] = None, daemons: bool = True) -> List[Thread
             thread. (This is the same meaning as the argument of the same name used in the traceback
             module)
         daemons: If True, include daemon threads.
+        active_only: If True, leave out threads that are idle -- blocked waiting on a
+            threading.Condition (which is what's underneath Event, Semaphore, Barrier, and
+            queue.Queue waits) or in Thread.join(), and not handling an exception. In a big
+            process these are usually most of the threads, and their stacks are rarely the
+            interesting ones. Threads blocked directly on a Lock (``lock.acquire()`` or ``with
+            lock:``), or in other C-level waits like ``time.sleep()``, can't be told apart from
+            running ones, and are always included.
 
     Returns:
         All the active threads, in no particular order.
     """
-    return _FrameState.all_stacks(limit=limit, daemons=daemons)
+    return _FrameState.all_stacks(limit=limit, daemons=daemons, active_only=active_only)
 
 
-def format_stacks(stacks: List[ThreadStack], group: bool = True) -> List[TraceLine]:
+def format_stacks(
+    stacks: List[ThreadStack], group: bool = True, source: bool = True
+) -> List[TraceLine]:
     """Format a list of stacks neatly for printing.
 
     Args:
         stacks: The stacks to format.
         group: If True, group together threads with identical traces.
+        source: If True, show the line of source code for each frame, just like the traceback
+            module does. If False, show only the file, line number, and function name, which is
+            more compact and skips looking up the source code.
     """
-    return _format_and_group(stacks) if group else _format_without_group(stacks)
+    return (
+        _format_and_group(stacks, source=source)
+        if group
+        else _format_without_group(stacks, source=source)
+    )
 
 
 def print_trace(lines: List[TraceLine], output: Optional[io.TextIOBase] = None) -> None:
@@ -210,6 +263,7 @@ def print_stacks(
     stacks: List[ThreadStack],
     output: Optional[io.TextIOBase] = None,
     group: bool = True,
+    source: bool = True,
 ) -> None:
     """Print a collection of thread stacks.
 
@@ -217,8 +271,9 @@ def print_stacks(
         stacks: The stacks to print.
         output: Where to write them to, defaulting to stderr.
         group: If True, group together threads with identical traces.
+        source: If True, show the line of source code for each frame.
     """
-    print_trace(format_stacks(stacks, group=group), output=output)
+    print_trace(format_stacks(stacks, group=group, source=source), output=output)
 
 
 #################################################################################################
@@ -236,27 +291,75 @@ class _FrameState(ABC):
     requires Python 3.10+, and a "lousy" way that works on earlier versions.
     """
 
+    __slots__ = ("frames", "filenames")
+
+    def __init__(self) -> None:
+        self.frames: Dict[int, FrameType] = sys._current_frames()
+        # All the source files that appear in stacks we've extracted.
+        self.filenames: Set[str] = set()
+
     @abstractmethod
     def get_stack(self, thread: threading.Thread, limit: Optional[int]) -> ThreadStack:
         """Get a ThreadStack for a single thread."""
         ...
 
     @abstractmethod
-    def get_all_stacks(self, limit: Optional[int], daemons: bool) -> List[ThreadStack]:
+    def get_all_stacks(
+        self, limit: Optional[int], daemons: bool, active_only: bool
+    ) -> List[ThreadStack]:
         """Get all the ThreadStacks."""
         ...
 
+    def clear(self) -> None:
+        """Drop all our references to frames and exceptions."""
+        self.frames.clear()
+
+    def threads(self, daemons: bool, active_only: bool) -> List[threading.Thread]:
+        """All live threads, optionally leaving out the daemons and the idle ones."""
+        threads = threading.enumerate()
+        if not daemons:
+            threads = [thread for thread in threads if not thread.daemon]
+        if active_only:
+            is_idle = self.is_idle
+            threads = [thread for thread in threads if not is_idle(thread.ident)]
+        return threads
+
+    def is_idle(self, ident: Optional[int]) -> bool:
+        """Is the given thread parked in one of the threading module's waits? We check this
+        before extracting the stack, so that idle threads cost us one dict lookup instead of a
+        walk through all their frames.
+        """
+        frame = self.frames.get(ident)  # type: ignore
+        return (
+            frame is not None
+            and frame.f_code.co_name in _WAIT_FUNCTIONS
+            and frame.f_code.co_filename == threading.__file__
+        )
+
     @staticmethod
-    def all_stacks(limit: Optional[int], daemons: bool) -> List[ThreadStack]:
+    def all_stacks(
+        limit: Optional[int], daemons: bool, active_only: bool
+    ) -> List[ThreadStack]:
         """This is safer than calling make() directly, since it makes sure to avoid refcounting
         loops. Read https://docs.python.org/3/library/inspect.html#the-interpreter-stack if you're
         wondering what this is or why. I'm not bothering with a "safe easy-to-use" API for this
         because this is an internal class for a _reason._
         """
+        state = _FrameState.make()
         try:
-            state = _FrameState.make()
-            return state.get_all_stacks(limit=limit, daemons=daemons)
+            stacks = state.get_all_stacks(
+                limit=limit, daemons=daemons, active_only=active_only
+            )
+            # Make sure linecache notices any source files that have changed since it read them.
+            # This is a stat() per file, so we do it just once per file, rather than once per
+            # file per thread the way traceback.extract_stack would.
+            for filename in state.filenames:
+                linecache.checkcache(filename)
+            return stacks
         finally:
+            # The frames we grabbed include the one that grabbed them, which references state; so
+            # deleting state alone leaves a cycle for the GC to find. Clearing breaks it right away.
+            state.clear()
             del state
 
     @staticmethod
@@ -269,8 +372,10 @@ class _FrameState(ABC):
 class _FrameState39(_FrameState):
     """Version that works on Python 3.9 and earlier"""
 
+    __slots__ = ("exception",)
+
     def __init__(self) -> None:
-        self.frames: Dict[int, FrameType] = sys._current_frames()
+        super().__init__()
         # In earlier versions of Python, there's no way to find the thread from an exception, so
         # instead, # if there is an active exception, we store its exc_info here, and print it
         # out like a fake "extra" thread -- because there's no way to know which thread it came
@@ -280,20 +385,22 @@ class _FrameState39(_FrameState):
     def get_stack(self, thread: threading.Thread, limit: Optional[int]) -> ThreadStack:
         # Alas, the exception here is always going to be None, because if there is an exception, we
         # have no way to tie it to the thread. :(
-        frame: Optional[FrameType] = (
-            self.frames[thread.ident]
-            if thread.ident is not None and thread.ident in self.frames
-            else None
-        )
+        frame = self.frames.get(thread.ident)  # type: ignore
 
         return ThreadStack(
             thread=thread,
-            stack=traceback.extract_stack(frame, limit=limit)
-            if frame is not None
-            else None,
+            stack=(
+                _extract_stack(frame, limit, self.filenames)
+                if frame is not None
+                else None
+            ),
             exception=None,
         )
 
+    def clear(self) -> None:
+        super().clear()
+        self.exception = None
+
     def get_extra_stack(self, limit: Optional[int]) -> Optional[ThreadStack]:
         """If there's an active exception, and we're in pre-3.10 land, create a fake "extra"
         stack entry for the exception.
@@ -303,17 +410,18 @@ class _FrameState39(_FrameState):
                 thread=None,
                 stack=None,
                 exception=self.exception,
+                limit=limit,
             )
             if self.exception is not None
             else None
         )
 
-    def get_all_stacks(self, limit: Optional[int], daemons: bool) -> List[ThreadStack]:
-        result = [
-            self.get_stack(thread, limit=limit)
-            for thread in threading.enumerate()
-            if daemons or not thread.daemon
-        ]
+    def get_all_stacks(
+        self, limit: Optional[int], daemons: bool, active_only: bool
+    ) -> List[ThreadStack]:
+        get_stack = self.get_stack
+        threads = self.threads(daemons, active_only)
+        result = [get_stack(thread, limit) for thread in threads]
         extra = self.get_extra_stack(limit)
         if extra is not None:
             result.append(extra)
@@ -324,82 +432,354 @@ class _FrameState39(_FrameState):
 class _FrameState310(_FrameState):
     """Version that works on Python 3.10+, and gets exception handling right."""
 
+    __slots__ = ("exceptions",)
+
     def __init__(self) -> None:
-        self.frames: Dict[int, FrameType] = sys._current_frames()
-        self.exceptions: Dict[int, BaseException] = {
-            thread_id: exc_info[1]
-            for thread_id, exc_info in sys._current_exceptions().items()  # type: ignore
-        }
+        super().__init__()
+        # We hold the live exceptions here, and only convert them to TracebackExceptions in
+        # get_stack, so that threads we end up not reporting never pay for it. These references
+        # (and the frame <-> traceback <-> exception cycles that come with them) are exactly as
+        # dangerous as the frames, and go away with the rest of this object.
+        self.exceptions: Dict[int, BaseException] = {}
+        for thread_id, exc_info in sys._current_exceptions().items():  # type: ignore
+            # Through 3.11 the values are exc_info triples; from 3.12 on they're the exceptions.
+            exception = exc_info[1] if isinstance(exc_info, tuple) else exc_info
+            if exception is not None:
+                self.exceptions[thread_id] = exception
 
     def get_stack(self, thread: threading.Thread, limit: Optional[int]) -> ThreadStack:
-        exception = (
-            self.exceptions.get(thread.ident, None)
-            if thread.ident is not None
-            else None
-        )
+        # Our dicts are keyed by int, so a None ident simply misses.
+        ident: int = thread.ident  # type: ignore
+        exception = self.exceptions.get(ident)
         frame: Optional[FrameType]
         if exception is not None:
             # Use the exception's stack frame, not the one where we're executing the stack trace
             # printer!
-            frame = (
-                exception.__traceback__.tb_frame if exception.__traceback__ else None
-            )
-        elif thread.ident is not None and thread.ident in self.frames:
-            frame = self.frames[thread.ident]
+            tb = exception.__traceback__
+            frame = tb.tb_frame if tb is not None else None
         else:
-            frame = None
+            frame = self.frames.get(ident)
 
         return ThreadStack(
             thread=thread,
-            stack=traceback.extract_stack(frame, limit=limit)
-            if frame is not None
-            else None,
+            stack=(
+                _extract_stack(frame, limit, self.filenames)
+                if frame is not None
+                else None
+            ),
             exception=exception,
+            limit=limit,
         )
 
-    def get_all_stacks(self, limit: Optional[int], daemons: bool) -> List[ThreadStack]:
-        return [
-            self.get_stack(thread, limit=limit)
-            for thread in threading.enumerate()
-            if daemons or not thread.daemon
-        ]
+    def clear(self) -> None:
+        super().clear()
+        self.exceptions.clear()
+
+    def is_idle(self, ident: Optional[int]) -> bool:
+        # A thread that's handling an exception is never idle, whatever it's doing right now.
+        return ident not in self.exceptions and super().is_idle(ident)
+
+    def get_all_stacks(
+        self, limit: Optional[int], daemons: bool, active_only: bool
+    ) -> List[ThreadStack]:
+        get_stack = self.get_stack
+        threads = self.threads(daemons, active_only)
+        return [get_stack(thread, limit) for thread in threads]
+
+
+# The functions in threading.py that a thread is sitting in (as its innermost Python frame) when
+# it's blocked: Condition.wait is underneath Event, Semaphore, Barrier, and queue.Queue waits.
+# Thread.join waits in _wait_for_tstate_lock through 3.12, and in C directly from join itself as
+# of 3.13. A thread blocked on a plain Lock is waiting in C, called straight from its own code, so
+# there's no threading.py frame to spot.
+_WAIT_FUNCTIONS = frozenset(("wait", "wait_for", "_wait_for_tstate_lock", "join"))
+
+
+def _extract_stack(
+    frame: FrameType, limit: Optional[int], filenames: Set[str]
+) -> traceback.StackSummary:
+    """Like traceback.extract_stack, but without looking up the lines of source code yet.
+
+    FrameSummary.line will fetch them if and when someone asks, so threads that never get
+    formatted with source (say, because they're grouped with an identical thread) cost us no
+    trips through linecache. We also skip checking whether the source files have changed; instead
+    we add their names to filenames, so the caller can check each one just once.
+    """
+    # This matches traceback.StackSummary.extract's handling of limits.
+    if limit is None:
+        limit = getattr(sys, "tracebacklimit", None)
+        if limit is not None and limit < 0:
+            limit = 0
+    frames: Iterable[Tuple[FrameType, int]] = traceback.walk_stack(frame)
+    if limit is not None:
+        frames = islice(frames, limit) if limit >= 0 else deque(frames, maxlen=-limit)
+
+    result: List[traceback.FrameSummary] = []
+    for current, lineno in frames:
+        code = current.f_code
+        filename = code.co_filename
+        if filename not in filenames:
+            filenames.add(filename)
+            linecache.lazycache(filename, current.f_globals)
+        result.append(
+            traceback.FrameSummary(filename, lineno, code.co_name, lookup_line=False)
+        )
+    result.reverse()
+    return traceback.StackSummary.from_list(result)
+
+
+def _traceback_exception(
+    exception: BaseException, limit: Optional[int]
+) -> traceback.TracebackException:
+    """Capture an exception, with at most limit frames of traceback (if limit is set) and no local
+    variables, so that deeply-recursive failures can't make us hold onto unbounded amounts of data.
+    Even with no limit, we cap each traceback in the chain at _MAX_TB_FRAMES frames.
+    """
+    result = traceback.TracebackException.from_exception(
+        exception, limit=limit, capture_locals=False, lookup_lines=False
+    )
+    pending = [result]
+    seen: Set[int] = set()
+    while pending:
+        current = pending.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        current.stack = _elide_frames(current.stack)
+        pending.extend(
+            chained
+            for chained in (current.__cause__, current.__context__)
+            if chained is not None
+        )
+    return result
+
+
+# The most frames we'll keep from any one exception's traceback. A runaway recursion can easily
+# produce tracebacks far deeper than anyone will read, and we may be holding one for every thread.
+_MAX_TB_FRAMES = 1000
+
+
+def _elide_frames(stack: traceback.StackSummary) -> traceback.StackSummary:
+    """If stack is longer than _MAX_TB_FRAMES, keep its first and last few hundred frames, with a
+    marker in between saying how many were dropped.
+    """
+    if len(stack) <= _MAX_TB_FRAMES:
+        return stack
+    keep = _MAX_TB_FRAMES // 2
+    elided = len(stack) - 2 * keep
+    marker = traceback.FrameSummary(
+        "<elided>", 0, f"... {elided} frames elided ...", lookup_line=False, line=""
+    )
+    return traceback.StackSummary.from_list(stack[:keep] + [marker] + stack[-keep:])
 
 
 # Logic for turning stacks into lists of TraceLines
 
 
-def _format_stack(stack: ThreadStack, title: Optional[str] = None) -> List[TraceLine]:
+FrameKey = Tuple[str, Optional[int], str]
+
+
+def _frame_keys(stack: Optional[traceback.StackSummary]) -> Tuple[FrameKey, ...]:
+    """The identifying parts of each frame in a stack: everything that shows up when formatted."""
+    return tuple((frame.filename, frame.lineno, frame.name) for frame in stack or ())
+
+
+def _exception_key(exception: traceback.TracebackException) -> Tuple[object, ...]:
+    """Everything that shows up when an exception is formatted: for each exception along the
+    chain that gets printed, its type and message, its frames, and how it links to the next one
+    (plus, for exception groups, the same for each of the grouped exceptions).
+    """
+    result: List[object] = []
+    current: Optional[traceback.TracebackException] = exception
+    # TracebackException already cuts any cycles in the chain, so this always terminates.
+    while current is not None:
+        link: Optional[str] = None
+        next_exception: Optional[traceback.TracebackException] = None
+        if current.__cause__ is not None:
+            link, next_exception = "cause", current.__cause__
+        elif current.__context__ is not None and not current.__suppress_context__:
+            link, next_exception = "context", current.__context__
+
+        grouped = getattr(current, "exceptions", None) or ()
+        result.append(
+            (
+                tuple(current.format_exception_only()),
+                _frame_keys(current.stack),
+                link,
+                tuple(_exception_key(member) for member in grouped),
+            )
+        )
+        current = next_exception
+    return tuple(result)
+
+
+def _exception_type_name(exception: traceback.TracebackException) -> str:
+    # TracebackException.exc_type is deprecated as of 3.13, in favor of exc_type_str, which is
+    # the type's qualified name (with its module, unless that's builtins or __main__).
+    type_str = getattr(exception, "exc_type_str", None)
+    if type_str is not None:
+        return str(type_str).rpartition(".")[2]
+    return exception.exc_type.__name__
+
+
+def _format_stack(
+    stack: ThreadStack,
+    title: Optional[str] = None,
+    source: bool = True,
+    frames: Optional["_FrameFormatter"] = None,
+) -> List[TraceLine]:
     """Format just this thread into a list of trace lines."""
-    title = title or stack.name
+    result = [_format_title(stack, title)]
+    # Unstarted threads have nothing but a title.
+    if stack.is_started:
+        result.extend(_format_body(stack, frames or _FrameFormatter(source)))
+    return result
 
-    result: List[TraceLine] = []
-    result.append(TraceLine(title + "\n", TraceLineType.THREAD_TITLE))
 
-    # Early-exit for unstarted threads
-    if not stack.is_started:
-        return result
+def _format_title(stack: ThreadStack, title: Optional[str] = None) -> TraceLine:
+    return TraceLine((title or stack.name) + "\n", TraceLineType.THREAD_TITLE)
 
+
+def _format_body(stack: ThreadStack, frames: "_FrameFormatter") -> List[TraceLine]:
+    """Format the stack and exception of a started thread, without its title.
+
+    Each block of frames becomes a single (multi-line) TraceLine, rather than one per frame: the
+    lines of a block all render the same way, so splitting them up would just mean allocating and
+    then writing out a TraceLine for every frame of every thread.
+    """
+    result: List[TraceLine] = []
     if stack.stack:
-        result.extend(TraceLine.as_trace(stack.stack.format()))
+        result.append(TraceLine(frames.format(stack.stack), TraceLineType.TRACE_LINE))
     else:
         result.append(TraceLine("<No stack found>\n", TraceLineType.TRACE_LINE))
 
     if stack.exception:
         result.append(
             TraceLine(
-                f"Exception: {stack.exception.exc_type.__name__}: {stack.exception}\n",
+                f"Exception: {_exception_type_name(stack.exception)}: {stack.exception}\n",
                 TraceLineType.EXCEPTION,
             )
         )
-        result.extend(TraceLine.as_trace(stack.exception.format()))
+        # With source, we let the traceback module render the exception, since it knows how to
+        # point at the exact failing expression within each line.
+        result.append(
+            TraceLine(
+                "".join(
+                    stack.exception.format()
+                    if frames.source
+                    else _format_exception_no_source(stack.exception, frames)
+                ),
+                TraceLineType.TRACE_LINE,
+            )
+        )
 
     return result
 
 
+# This matches the traceback module: runs of more than this many identical frames (i.e.,
+# recursion) get collapsed into a "[Previous line repeated...]" note.
+_RECURSIVE_CUTOFF = 3
+
+
+class _FrameFormatter(object):
+    """Formats blocks of frames the way StackSummary.format() does (optionally leaving out the
+    source code), but remembers each distinct frame it's seen. Nearly every thread shares some
+    frames with the others -- if nothing else, threading's bootstrap -- so over the course of a
+    whole trace, each of those only gets formatted once.
+    """
+
+    __slots__ = ("source", "_cache")
+
+    def __init__(self, source: bool) -> None:
+        self.source = source
+        self._cache: Dict[FrameKey, str] = {}
+
+    def format(self, stack: traceback.StackSummary) -> str:
+        result: List[str] = []
+        last: Optional[FrameKey] = None
+        count = 0
+        for frame in stack:
+            key = (frame.filename, frame.lineno, frame.name)
+            if key != last:
+                if count > _RECURSIVE_CUTOFF:
+                    result.append(_repeated(count - _RECURSIVE_CUTOFF))
+                last = key
+                count = 0
+            count += 1
+            if count > _RECURSIVE_CUTOFF:
+                continue
+
+            formatted = self._cache.get(key)
+            if formatted is None:
+                formatted = self._cache[key] = self._format_frame(frame)
+            result.append(formatted)
+
+        if count > _RECURSIVE_CUTOFF:
+            result.append(_repeated(count - _RECURSIVE_CUTOFF))
+        return "".join(result)
+
+    def _format_frame(self, frame: traceback.FrameSummary) -> str:
+        result = f'  File "{frame.filename}", line {frame.lineno}, in {frame.name}\n'
+        if self.source and frame.line:
+            result += f"    {frame.line.strip()}\n"
+        return result
+
+
+def _repeated(count: int) -> str:
+    return f'  [Previous line repeated {count} more time{"s" if count > 1 else ""}]\n'
+
+
+# These match the separators the traceback module uses between chained exceptions.
+_CAUSE_MESSAGE = (
+    "\nThe above exception was the direct cause of the following exception:\n\n"
+)
+_CONTEXT_MESSAGE = (
+    "\nDuring handling of the above exception, another exception occurred:\n\n"
+)
+
+
+def _format_exception_no_source(
+    exception: traceback.TracebackException, frames: _FrameFormatter
+) -> Iterator[str]:
+    """Like TracebackException.format(), but without the lines of source code."""
+    if exception.__cause__ is not None:
+        yield from _format_exception_no_source(exception.__cause__, frames)
+        yield _CAUSE_MESSAGE
+    elif exception.__context__ is not None and not exception.__suppress_context__:
+        yield from _format_exception_no_source(exception.__context__, frames)
+        yield _CONTEXT_MESSAGE
+
+    members = getattr(exception, "exceptions", None)
+    if exception.stack:
+        yield "Exception Group " if members else ""
+        yield "Traceback (most recent call last):\n"
+        yield frames.format(exception.stack)
+    yield from exception.format_exception_only()
+
+    # An exception group's members go after it, each in its own indented section. Like the
+    # traceback module, we only show the first _MAX_GROUP_WIDTH of them.
+    if members:
+        for index, member in enumerate(members[:_MAX_GROUP_WIDTH], 1):
+            yield f"+---------------- {index} ----------------\n"
+            for chunk in _format_exception_no_source(member, frames):
+                yield "".join("    " + line for line in chunk.splitlines(True))
+        if len(members) > _MAX_GROUP_WIDTH:
+            yield "+---------------- ... ----------------\n"
+            extra = len(members) - _MAX_GROUP_WIDTH
+            yield f"    and {extra} more exception{'s' if extra > 1 else ''}\n"
+        yield "+------------------------------------\n"
+
+
+# The most members of an exception group we show, matching the traceback module's default.
+_MAX_GROUP_WIDTH = 15
+
+
 MAX_THREADS_NAMED = 3
 
 
-def _format_stack_group(stacks: List[ThreadStack]) -> List[TraceLine]:
+def _format_stack_group(
+    stacks: List[ThreadStack], frames: _FrameFormatter
+) -> List[TraceLine]:
     """Format a group of threads with identical stacks."""
     assert len(stacks)
     title: Optional[str] = None
@@ -409,27 +789,32 @@ def _format_stack_group(stacks: List[ThreadStack]) -> List[TraceLine]:
         if len(stacks) > MAX_THREADS_NAMED:
             title += " and others"
 
-    return _format_stack(stacks[0], title=title)
+    return _format_stack(stacks[0], title=title, frames=frames)
 
 
-ThreadGroup = Dict[int, List[ThreadStack]]
+ThreadGroup = Dict[Tuple[object, ...], List[ThreadStack]]
 
 
 def _append_group(
-    result: List[TraceLine], group: ThreadGroup, is_first: bool = False
+    result: List[TraceLine],
+    group: ThreadGroup,
+    frames: _FrameFormatter,
+    is_first: bool = False,
 ) -> None:
     for index, stacks in enumerate(group.values()):
         if index or not is_first:
             result.append(TraceLine.blank())
-        result.extend(_format_stack_group(stacks))
+        result.extend(_format_stack_group(stacks, frames))
 
 
-def _format_and_group(stacks: List[ThreadStack]) -> List[TraceLine]:
+def _format_and_group(
+    stacks: List[ThreadStack], source: bool = True
+) -> List[TraceLine]:
     # First, let's group the stacks.
-    unstarted_threads: ThreadGroup = defaultdict(list)
-    started_daemons: ThreadGroup = defaultdict(list)
-    started_non_daemons: ThreadGroup = defaultdict(list)
-    failing: ThreadGroup = defaultdict(list)
+    unstarted_threads: ThreadGroup = {}
+    started_daemons: ThreadGroup = {}
+    started_non_daemons: ThreadGroup = {}
+    failing: ThreadGroup = {}
 
     group: ThreadGroup
     for stack in stacks:
@@ -442,23 +827,36 @@ def _format_and_group(stacks: List[ThreadStack]) -> List[TraceLine]:
         else:
             group = started_non_daemons
 
-        group[stack.cluster_id].append(stack)
+        group.setdefault(stack.cluster_key, []).append(stack)
 
     # Now let's format the groups. We'll put the special groups at the end.
     result: List[TraceLine] = []
-    _append_group(result, unstarted_threads, is_first=True)
-    _append_group(result, started_daemons)
-    _append_group(result, started_non_daemons)
-    _append_group(result, failing)
+    frames = _FrameFormatter(source)
+    _append_group(result, unstarted_threads, frames, is_first=True)
+    _append_group(result, started_daemons, frames)
+    _append_group(result, started_non_daemons, frames)
+    _append_group(result, failing, frames)
     return result
 
 
-def _format_without_group(stacks: List[ThreadStack]) -> List[TraceLine]:
+def _format_without_group(
+    stacks: List[ThreadStack], source: bool = True
+) -> List[TraceLine]:
     result: List[TraceLine] = []
+    frames = _FrameFormatter(source)
+    # Even ungrouped, threads with identical stacks (e.g. a pool of workers) have identical bodies,
+    # so we only format each distinct one once. We go by the full key, not by cluster_id, so that
+    # a hash collision can't make us print one thread's data under another's name.
+    bodies: Dict[Tuple[object, ...], List[TraceLine]] = {}
     for index, stack in enumerate(stacks):
         if index:
             result.append(TraceLine.blank())
-        result.extend(_format_stack(stack))
+        result.append(_format_title(stack))
+        if stack.is_started:
+            body = bodies.get(stack.cluster_key)
+            if body is None:
+                body = bodies[stack.cluster_key] = _format_body(stack, frames)
+            result.extend(body)
     return result
 
 
@@ -469,9 +867,6 @@ class _LineWrap(NamedTuple):
     before: str = ""
     after: str = ""
 
-    def wrap(self, line: str) -> str:
-        return self.before + line + self.after
-
     @classmethod
     def color(cls, *colors: int) -> "_LineWrap":
         # Pick a VT100 color
@@ -482,18 +877,14 @@ class _LineWrap(NamedTuple):
 class _LineWraps(object):
     def __init__(self, data: Dict[TraceLineType, _LineWrap]) -> None:
         self.data = data
+        # The (before, after) pair for each line type, indexed by the type's value. This way the
+        # per-line work in _write is just indexing a tuple, rather than a dict lookup (which has to
+        # hash the enum) plus a couple of method calls.
+        self.prefix_suffix: Tuple[Tuple[str, str], ...] = tuple(
+            (wrap.before, wrap.after)
+            for _, wrap in sorted(data.items(), key=lambda item: item[0].value)
+        )
 
-    def wrap(self, line: TraceLine) -> str:
-        return self.data[line.line_type].wrap(line.line)
-
-
-_NON_TTY_WRAPS = _LineWraps(
-    {
-        TraceLineType.THREAD_TITLE: _LineWrap(),
-        TraceLineType.TRACE_LINE: _LineWrap(),
-        TraceLineType.EXCEPTION: _LineWrap(),
-    }
-)
 
 _TTY_WRAPS = _LineWraps(
     {
@@ -506,6 +897,18 @@ _TTY_WRAPS = _LineWraps(
 
 def _write(file: Union[TextIO, io.TextIOBase], trace: List[TraceLine]) -> None:
     """Write a trace, nicely formatted, to a file."""
-    wraps = _TTY_WRAPS if file.isatty() else _NON_TTY_WRAPS
+    # Assemble the whole thing and write it at once: stderr is unbuffered, so writing it line by
+    # line would mean a syscall (and a trip through the stream's lock) per line, and would let
+    # output from other threads get interleaved with ours.
+    if not file.isatty():
+        # Nothing gets wrapped when we aren't writing to a terminal.
+        file.write("".join([entry.line for entry in trace]))
+        return
+
+    prefix_suffix = _TTY_WRAPS.prefix_suffix
+    parts: List[str] = []
+    extend = parts.extend
     for entry in trace:
-        file.write(wraps.wrap(entry))
+        before, after = prefix_suffix[entry.line_type.value]
+        extend((before, entry.line, after))
+    file.write("".join(parts))
@@ -1,5 +1,8 @@
 import threading
+import time
 import unittest
+import weakref
+from functools import partial
 from typing import List
 
 from pyppin.testing.turn_taker import TurnTaker
@@ -166,6 +169,143 @@ class SemaphoreTest(unittest.TestCase):
             print(indices)
             raise AssertionError("Got operations in an unexpected order:\n" + indented)
 
+    def testWaitersAreServedInOrder(self) -> None:
+        ops: List[str] = []
+        sem = Semaphore(2)
+        self.assertTrue(sem.try_acquire(2))
+
+        def worker(name: str, amount: int) -> None:
+            with sem.get(amount=amount):
+                ops.append(f"{name} acquired {amount}")
+
+        def wait_for_waiters(count: int) -> None:
+            while len(sem._waiters) < count:
+                time.sleep(0.001)
+
+        big = threading.Thread(target=worker, args=("big", 2))
+        big.start()
+        wait_for_waiters(1)
+        small = threading.Thread(target=worker, args=("small", 1))
+        small.start()
+        wait_for_waiters(2)
+
+        # One unit is now free, which would satisfy "small" -- but it's queued behind "big", and
+        # newcomers can't jump the queue either.
+        sem.release(1)
+        self.assertFalse(sem.try_acquire(1))
+        self.assertEqual([], ops)
+
+        sem.release(1)
+        big.join()
+        small.join()
+        self.assertEqual(["big acquired 2", "small acquired 1"], ops)
+        self.assertEqual(Semaphore.Status(2, 0, False), sem.status)
+
+    def testTimedOutWaiterLeavesQueue(self) -> None:
+        sem = Semaphore(1)
+        self.assertTrue(sem.try_acquire(1))
+        self.assertEqual(Semaphore.AcquireResult.TIMEOUT, sem.acquire(1, timeout=0.01))
+        self.assertEqual(0, len(sem._waiters))
+        sem.release(1)
+        self.assertTrue(sem.try_acquire(1))
+
+    def testOversizedRequests(self) -> None:
+        sem = Semaphore(2)
+        self.assertEqual(Semaphore.AcquireResult.TIMEOUT, sem.acquire(3, timeout=0))
+        self.assertEqual(Semaphore.AcquireResult.TIMEOUT, sem.acquire(3, timeout=0.01))
+        self.assertEqual(0, len(sem._waiters))
+
+        # A request that can't fit in the whole capacity waits, but doesn't hold anyone else up.
+        results: List[Semaphore.AcquireResult] = []
+        big = threading.Thread(target=lambda: results.append(sem.acquire(3)))
+        big.start()
+        while len(sem._waiters) < 1:
+            time.sleep(0.001)
+        self.assertTrue(sem.try_acquire(1))
+        self.assertEqual(Semaphore.AcquireResult.SUCCESS, sem.acquire(1, timeout=0.01))
+        sem.release(2)
+
+        # Until there's room for it.
+        sem.set_capacity(3)
+        big.join()
+        self.assertEqual([Semaphore.AcquireResult.SUCCESS], results)
+        sem.release(3)
+
+    def testZeroCapacity(self) -> None:
+        sem = Semaphore(1)
+        sem.set_capacity(0)
+        self.assertFalse(sem.try_acquire())
+
+        acquired = threading.Event()
+
+        def worker() -> None:
+            with sem:
+                acquired.set()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        while len(sem._waiters) < 1:
+            time.sleep(0.001)
+        self.assertFalse(acquired.is_set())
+
+        sem.set_capacity(1)
+        thread.join()
+        self.assertTrue(acquired.is_set())
+        self.assertEqual(Semaphore.Status(1, 0, False), sem.status)
+
+    def testShrunkCapacityDoesNotBlockQueue(self) -> None:
+        sem = Semaphore(5)
+        self.assertTrue(sem.try_acquire(2))
+        results: List[Semaphore.AcquireResult] = []
+        big = threading.Thread(target=lambda: results.append(sem.acquire(4)))
+        big.start()
+        while len(sem._waiters) < 1:
+            time.sleep(0.001)
+
+        # "big" can no longer ever fit, so it mustn't hold up smaller requests.
+        sem.set_capacity(3)
+        self.assertTrue(sem.try_acquire(1))
+        self.assertEqual(Semaphore.AcquireResult.TIMEOUT, sem.acquire(1, timeout=0.01))
+        sem.release(3)
+
+        # Once there's room for it again, it gets served.
+        sem.set_capacity(5)
+        big.join()
+        self.assertEqual([Semaphore.AcquireResult.SUCCESS], results)
+        self.assertEqual(Semaphore.Status(5, 4, False), sem.status)
+
+    def testWeakReferences(self) -> None:
+        sem = Semaphore(1)
+        self.assertIs(sem, weakref.ref(sem)())
+
+    def testRun(self) -> None:
+        sem = Semaphore(2)
+
+        def check_status(expected_current: int, timeout: float = 0) -> str:
+            self.assertEqual(Semaphore.Status(2, expected_current, False), sem.status)
+            return f"ok {timeout}"
+
+        self.assertEqual("ok 0", sem.run(partial(check_status, 1)))
+        self.assertEqual("ok 0", sem.run(partial(check_status, 2), amount=2))
+        # The function's own arguments never get mixed up with the semaphore's.
+        self.assertEqual(
+            "ok 5", sem.run(partial(check_status, 1, timeout=5), timeout=1)
+        )
+        self.assertEqual(Semaphore.Status(2, 0, False), sem.status)
+
+        self.assertTrue(sem.try_acquire(1))
+        with self.assertRaises(TimeoutError):
+            sem.run(partial(check_status, 3), amount=2, timeout=0)
+        sem.release(1)
+
+        with self.assertRaises(ValueError):
+            sem.run(partial(int, "not a number"))
+        self.assertEqual(Semaphore.Status(2, 0, False), sem.status)
+
+        sem.stop()
+        with self.assertRaises(BrokenPipeError):
+            sem.run(partial(check_status, 1))
+
 
 # Simple test: thread 1 acquires, thread 2 requests and blocks, thread 1 releases, thread 2
 # unblocks. Do this with threads appending to a vector when they unblock.
@@ -0,0 +1,222 @@
+import gc
+import io
+import sys
+import threading
+import time
+import traceback
+import unittest
+import weakref
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from pyppin.threading.stack_trace import print_all_stacks
+from pyppin.threading.stack_trace_internals import (
+    _MAX_TB_FRAMES,
+    ThreadStack,
+    _FrameState,
+    all_stacks,
+    format_stacks,
+)
+
+
+@contextmanager
+def parked_threads(count: int) -> Iterator[None]:
+    """Run count identical threads, which are all blocked until the context exits."""
+    event = threading.Event()
+    threads = [
+        threading.Thread(target=event.wait, name=f"Parked-{index}")
+        for index in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        # Wait until every thread has actually settled into the same place.
+        while (
+            len({stack.cluster_id for stack in all_stacks() if stack.thread in threads})
+            != 1
+        ):
+            time.sleep(0.001)
+        yield
+    finally:
+        event.set()
+        for thread in threads:
+            thread.join()
+
+
+def _fail_and_wait(cause: str, event: threading.Event) -> None:
+    try:
+        try:
+            raise KeyError(cause)
+        except KeyError:
+            raise ValueError("boom")
+    except ValueError:
+        event.wait()
+
+
+@contextmanager
+def failing_threads(*causes: str) -> Iterator[None]:
+    """Run threads that are all handling a ValueError from the same place, each with a different
+    KeyError as its context, and are blocked until the context exits.
+    """
+    event = threading.Event()
+    threads = [
+        threading.Thread(
+            target=_fail_and_wait, args=(cause, event), name=f"Failing-{cause}"
+        )
+        for cause in causes
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while len(
+            [
+                stack
+                for stack in all_stacks()
+                if stack.thread in threads and stack.exception is not None
+            ]
+        ) != len(threads):
+            time.sleep(0.001)
+        yield
+    finally:
+        event.set()
+        for thread in threads:
+            thread.join()
+
+
+class StackTraceTest(unittest.TestCase):
+    def testIdenticalThreadsAreGrouped(self) -> None:
+        buffer = io.StringIO()
+        with parked_threads(4):
+            print_all_stacks(output=buffer)
+
+        result = buffer.getvalue()
+        self.assertIn('4 Threads: Thread "Parked-', result)
+        self.assertIn("and others", result)
+        self.assertIn('Thread "MainThread"', result)
+
+    def testUngroupedThreads(self) -> None:
+        buffer = io.StringIO()
+        with parked_threads(2):
+            print_all_stacks(output=buffer, group=False)
+
+        result = buffer.getvalue()
+        self.assertNotIn("Threads:", result)
+        self.assertIn('Thread "Parked-0"', result)
+        self.assertIn('Thread "Parked-1"', result)
+
+    @unittest.skipUnless(
+        hasattr(sys, "_current_exceptions"), "Needs per-thread exceptions"
+    )
+    def testDifferentExceptionChainsAreNotMerged(self) -> None:
+        for group in (True, False):
+            buffer = io.StringIO()
+            with failing_threads("first-cause", "second-cause"):
+                print_all_stacks(output=buffer, group=group)
+
+            result = buffer.getvalue()
+            self.assertIn("KeyError: 'first-cause'", result)
+            self.assertIn("KeyError: 'second-cause'", result)
+
+    def testActiveOnly(self) -> None:
+        with parked_threads(2):
+            everything = {stack.thread for stack in all_stacks()}
+            parked = {
+                thread
+                for thread in everything
+                if thread is not None and thread.name.startswith("Parked-")
+            }
+            self.assertEqual(2, len(parked))
+
+            # A thread waiting in join() is idle too.
+            joiner = threading.Thread(target=next(iter(parked)).join, name="Joiner")
+            joiner.start()
+            deadline = time.monotonic() + 5
+            while True:
+                active = {stack.thread for stack in all_stacks(active_only=True)}
+                if joiner not in active or time.monotonic() > deadline:
+                    break
+                time.sleep(0.001)
+
+        joiner.join()
+        self.assertIn(threading.current_thread(), active)
+        self.assertFalse(parked & active)
+        self.assertNotIn(joiner, active)
+
+    def testDeepTracebacksAreElided(self) -> None:
+        def recurse(depth: int) -> None:
+            if depth:
+                recurse(depth - 1)
+            else:
+                raise ValueError("Bottom")
+
+        old_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(old_limit + 2 * _MAX_TB_FRAMES)
+        try:
+            recurse(2 * _MAX_TB_FRAMES)
+        except ValueError as e:
+            stack = ThreadStack(thread=None, stack=None, exception=e)
+        finally:
+            sys.setrecursionlimit(old_limit)
+
+        assert stack.exception is not None
+        self.assertEqual(_MAX_TB_FRAMES + 1, len(stack.exception.stack))
+        result = "".join(line.line for line in stack.formatted)
+        self.assertIn("frames elided", result)
+        self.assertIn("ValueError: Bottom", result)
+
+    def testFramesFormatLikeTraceback(self) -> None:
+        def recurse(depth: int) -> traceback.StackSummary:
+            return recurse(depth - 1) if depth else traceback.extract_stack()
+
+        summary = recurse(10)
+        stack = ThreadStack(thread=None, stack=summary, exception=None)
+        result = "".join(line.line for line in stack.formatted)
+        self.assertIn("".join(summary.format()), result)
+        self.assertIn("[Previous line repeated 8 more times]", result)
+
+    def testFramesAreReleased(self) -> None:
+        gc.collect()
+        gc.disable()
+        try:
+            all_stacks()
+            # Nothing should be left for the GC to clean up.
+            leaked = [obj for obj in gc.get_objects() if isinstance(obj, _FrameState)]
+        finally:
+            gc.enable()
+        self.assertEqual([], leaked)
+
+    @unittest.skipUnless(sys.version_info >= (3, 11), "Needs exception groups")
+    def testExceptionGroupsWithoutSource(self) -> None:
+        members: List[Exception] = []
+        for member in (ValueError("first"), KeyError("second")):
+            try:
+                raise member
+            except Exception as e:
+                members.append(e)
+
+        try:
+            raise ExceptionGroup("group", members)  # noqa: F821
+        except Exception as e:
+            stack = ThreadStack(thread=None, stack=None, exception=e)
+
+        result = "".join(line.line for line in format_stacks([stack], source=False))
+        self.assertIn("ExceptionGroup: group (2 sub-exceptions)", result)
+        self.assertIn("ValueError: first", result)
+        self.assertIn("KeyError: 'second'", result)
+        self.assertNotIn("raise member", result)
+
+    def testWeakReferences(self) -> None:
+        stack = ThreadStack(thread=None, stack=None, exception=None)
+        self.assertIs(stack, weakref.ref(stack)())
+
+    def testWithoutSource(self) -> None:
+        buffer = io.StringIO()
+        print_all_stacks(output=buffer)
+        self.assertIn("print_all_stacks(output=buffer)", buffer.getvalue())
+
+        buffer = io.StringIO()
+        print_all_stacks(output=buffer, source=False)
+        result = buffer.getvalue()
+        self.assertIn(f'File "{__file__}"', result)
+        self.assertIn("in testWithoutSource", result)
+        self.assertNotIn("print_all_stacks(output=buffer", result)